@@ -0,0 +1,26 @@
+"""Add partial index for valid conversations of a user
+
+Revision ID: e3b5c1f0a9d2
+Revises: 333722b0921e
+Create Date: 2026-10-15 11:52:04.518362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b5c1f0a9d2'
+down_revision = '333722b0921e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_conversation_user_id_valid', 'conversation', ['user_id'], unique=False,
+                    sqlite_where=sa.text('is_valid = 1'), postgresql_where=sa.text('is_valid = true'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversation_user_id_valid', table_name='conversation',
+                  sqlite_where=sa.text('is_valid = 1'), postgresql_where=sa.text('is_valid = true'))
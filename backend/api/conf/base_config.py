@@ -49,8 +49,8 @@ class BaseConfig(Generic[T]):
             raise ConfigException(f"Config file not found: {self._config_path}")
         try:
             with open(self._config_path, mode='r', encoding='utf-8') as f:
-                # 读取配置
-                yaml = YAML()
+                # 读取配置；只需要数据而不需要保留注释和格式，使用 safe 加载器（有 C 扩展时速度快得多）
+                yaml = YAML(typ='safe')
                 config_dict = yaml.load(f) or {}
                 self._model = self._model_type.model_validate(config_dict)
         except Exception as e:
@@ -0,0 +1,3 @@
+from .guid import GUID
+from .pydantic_type import Pydantic
+from .utc_datetime import UTCDateTime
@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import List, Optional
 
 from fastapi_users_db_sqlalchemy import Integer
-from sqlalchemy import String, Enum, Boolean, ForeignKey, func, Float
+from sqlalchemy import String, Enum, Boolean, ForeignKey, func, Float, Index, text
 from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column
 
 from api.database.custom_types import Pydantic, UTCDateTime, GUID
@@ -69,6 +69,11 @@ class BaseConversation(Base):
         "polymorphic_on": "source",
         "polymorphic_identity": "base",
     }
+    __table_args__ = (
+        # 部分索引，用于查询用户的有效会话（user_id = ? AND is_valid = 1）
+        Index("ix_conversation_user_id_valid", "user_id",
+              sqlite_where=text("is_valid = 1"), postgresql_where=text("is_valid = true")),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     source: Mapped[ChatSourceTypes] = mapped_column(Enum(ChatSourceTypes), comment="对话类型")
@@ -3,6 +3,7 @@ import typing
 from typing import Optional, Any, Generic, TypeVar, Dict
 
 import httpx
+import orjson
 from fastapi import Response
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
@@ -49,8 +50,9 @@ class CustomJSONResponse(Response):
     def render(self, content: typing.Any) -> bytes:
         if not isinstance(content, ResponseWrapper):
             content = ResponseWrapper(code=self.status_code, message=get_http_message(self.status_code), result=content)
-        result = json.dumps(jsonable_encoder(content), ensure_ascii=False)
-        return result.encode("utf-8")
+        # orjson 直接处理 dict/list/datetime/UUID/Enum 等类型，仅对其无法处理的对象（如 pydantic 模型）回退到 jsonable_encoder
+        return orjson.dumps({"code": content.code, "message": content.message, "result": content.result},
+                            default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
 
 
 class PrettyJSONResponse(Response):
@@ -23,7 +23,7 @@ from api.models.db import User, BaseConversation
 from api.models.doc import OpenaiApiChatMessage, OpenaiApiConversationHistoryDocument, OpenaiApiChatMessageTextContent, \
     AskLogDocument, OpenaiWebAskLogMeta, \
     OpenaiApiAskLogMeta
-from api.routers.conv import _get_conversation_by_id
+from api.routers.conv import _load_conversation
 from api.schemas import AskRequest, AskResponse, AskResponseType, UserReadAdmin, \
     BaseConversationSchema
 from api.schemas.openai_schemas import OpenaiChatPlugin, OpenaiChatPluginUserSettings, OpenaiChatPluginListResponse
@@ -291,7 +291,8 @@ async def chat(websocket: WebSocket):
     if not ask_request.new_conversation:
         assert ask_request.conversation_id is not None
         conversation_id = ask_request.conversation_id
-        conversation = await _get_conversation_by_id(ask_request.conversation_id, user_db)
+        async with get_async_session_context() as session:
+            conversation = await _load_conversation(session, ask_request.conversation_id, user_db)
 
         # 是否可用 team 对话
         if conversation is not None and conversation.source_id is not None and use_team == False:
@@ -445,6 +446,8 @@ async def chat(websocket: WebSocket):
         if ask_request.source == ChatSourceTypes.openai_web:
             openai_web_manager.semaphore.release()
             await change_user_chat_status(user.id, OpenaiWebChatStatus.idling)
+            if conversation_id is not None:
+                openai_web_manager.invalidate_conversation_history(conversation_id)
 
     ask_stop_time = time.time()
     queueing_time = 0
@@ -1,12 +1,18 @@
+import asyncio
 import uuid
-from typing import List, Union
+from functools import lru_cache
+from typing import List, Union, Iterable
 
 import httpx
-from fastapi import APIRouter, Depends
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy import select, and_, delete
+from fastapi import APIRouter, Depends, Query
+from pydantic import TypeAdapter
+from sqlalchemy import select, and_, delete, update, lambda_stmt, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
 
-from api.database.sqlalchemy import get_async_session_context
+from api.database.sqlalchemy import get_async_session_context, get_async_session
 from api.enums import ChatSourceTypes
 from api.exceptions import InvalidParamsException, AuthorityDenyException, InternalException, OpenaiWebException
 from api.models.db import User, OpenaiWebConversation, BaseConversation
@@ -23,17 +29,99 @@ logger = get_logger(__name__)
 router = APIRouter()
 openai_web_manager = OpenaiWebChatManager()
 
+# 超过该数量的会话列表放到线程池中序列化，避免阻塞事件循环
+THREADPOOL_DUMP_THRESHOLD = 200
+
+_conversation_columns = tuple(BaseConversation.__table__.columns)
+_conversation_keys = tuple(column.key for column in _conversation_columns)
+_conversation_schemas = {
+    ChatSourceTypes.openai_web: OpenaiWebConversationSchema,
+    ChatSourceTypes.openai_api: OpenaiApiConversationSchema,
+}
+
+# 会话列表的查询语句只构建一次，每次请求仅传入参数
+_my_conversations_stmt = select(*_conversation_columns).where(
+    and_(BaseConversation.user_id == bindparam("user_id"), BaseConversation.is_valid == True))
+_all_conversations_stmt = select(*_conversation_columns).order_by(BaseConversation.id).offset(bindparam("offset"))
+_all_valid_conversations_stmt = _all_conversations_stmt.where(BaseConversation.is_valid == True)
+
+
+@lru_cache(maxsize=None)
+def _get_conversation_list_adapter() -> TypeAdapter:
+    """
+    会话 schema 使用了 defer_build，这里同样在首次使用时才构建 TypeAdapter，之后复用
+    """
+    return TypeAdapter(list[BaseConversationSchema | OpenaiWebConversationSchema | OpenaiApiConversationSchema])
+
+
+def _construct_conversation(values: tuple) -> BaseConversationSchema:
+    """
+    注意：model_construct 跳过校验，仅可用于来自数据库的可信数据，不要用于处理用户输入
+    """
+    fields = dict(zip(_conversation_keys, values))
+    schema = _conversation_schemas.get(fields["source"], BaseConversationSchema)
+    return schema.model_construct(**fields)
+
+
+@lru_cache(maxsize=4096)
+def _encode_conversation(values: tuple) -> dict:
+    """
+    以会话的全部列值作为缓存键，任意一列变化（如标题、有效性）都会得到新的编码结果
+    缓存的是序列化后的 dict，命中时既不需要构建 schema 对象，也不需要再次序列化
+    注意：返回的 dict 被缓存共享，调用方不应修改
+    """
+    return _construct_conversation(values).model_dump(mode="json")
+
+
+def _conversation_values(conversation: BaseConversation) -> tuple:
+    return tuple(getattr(conversation, key) for key in _conversation_keys)
 
-async def _get_conversation_by_id(conversation_id: str | uuid.UUID, user: User = Depends(current_active_user)):
-    async with get_async_session_context() as session:
-        r = await session.execute(
-            select(BaseConversation).where(BaseConversation.conversation_id == str(conversation_id)))
-        conversation = r.scalars().one_or_none()
-        if conversation is None:
-            raise InvalidParamsException("errors.conversationNotFound")
-        if not user.is_superuser and conversation.user_id != user.id:
-            raise AuthorityDenyException
-        return conversation
+
+def _encode_conversations(rows: Iterable[tuple]) -> list[dict]:
+    """
+    rows 为按 _conversation_columns 顺序排列的列值
+    缓存面向用户反复拉取的 /conv；管理员的全量列表顺序扫描所有会话，既不会命中，还会把其他用户的缓存项挤出去，
+    因此不要用于 /conv/all
+    """
+    return [_encode_conversation(tuple(row)) for row in rows]
+
+
+def _construct_conversations(rows: Iterable[tuple]) -> list[BaseConversationSchema]:
+    """
+    不经过缓存，构建的 schema 对象交给 _dump_conversations 序列化
+    """
+    return [_construct_conversation(tuple(row)) for row in rows]
+
+
+def _dump_conversations(conversations: list[BaseConversationSchema]) -> list[dict]:
+    """
+    用于不经过缓存的会话列表，直接使用预先构建的 TypeAdapter 序列化，跳过 FastAPI 对 response_model 的再次校验
+    """
+    return _get_conversation_list_adapter().dump_python(conversations, mode="json")
+
+
+async def _load_conversation(session: AsyncSession, conversation_id: str | uuid.UUID, user: User):
+    """
+    在给定的 session 中加载会话并检查权限；不在请求依赖中的调用方（如 websocket）需自行打开 session
+    """
+    conversation_id = str(conversation_id)
+    r = await session.execute(
+        lambda_stmt(lambda: select(BaseConversation).where(BaseConversation.conversation_id == conversation_id)))
+    conversation = r.scalar_one_or_none()
+    if conversation is None:
+        raise InvalidParamsException("errors.conversationNotFound")
+    if not user.is_superuser and conversation.user_id != user.id:
+        raise AuthorityDenyException
+    return conversation
+
+
+async def _get_conversation_by_id(conversation_id: str | uuid.UUID, user: User = Depends(current_active_user),
+                                  session: AsyncSession = Depends(get_async_session)):
+    """
+    会话从请求级的 session 中加载，endpoint 中同样依赖 get_async_session 即可拿到同一个 session，
+    直接修改 conversation 并 commit，无需再打开新的 session
+    """
+    return await _load_conversation(session, conversation_id, user)
 
 
 @router.get("/conv", tags=["conversation"],
@@ -42,43 +130,59 @@ async def _get_conversation_by_id(conversation_id: str | uuid.UUID, user: User =
 async def get_my_conversations(user: User = Depends(current_active_user)):
     """
     返回自己的有效会话
+    只查询列值而不构建 ORM 对象
     """
     async with get_async_session_context() as session:
-        r = await session.execute(select(BaseConversation).where(
-            and_(BaseConversation.user_id == user.id, BaseConversation.is_valid == True)
-        ))
-        results = r.scalars().all()
-        results = jsonable_encoder(results)
-        return results
+        r = await session.execute(_my_conversations_stmt, {"user_id": user.id})
+        return response(200, result=_encode_conversations(r.all()))
 
 
 @router.get("/conv/all", tags=["conversation"],
             response_model=List[BaseConversationSchema])
-async def get_all_conversations(_user: User = Depends(current_super_user), valid_only: bool = False):
+async def get_all_conversations(_user: User = Depends(current_super_user), valid_only: bool = False,
+                                offset: int = Query(0, ge=0), limit: int | None = Query(None, ge=1)):
+    """
+    不指定 limit 时返回全部会话
+    会话数量可能很多，因此分批流式读取，每批到达后立即序列化，只保留序列化结果，schema 对象随即释放；不经过 lru_cache
+    累计数量超过 THREADPOOL_DUMP_THRESHOLD 后，之后的批次放到线程池中序列化
+    """
+    result = []
     async with get_async_session_context() as session:
-        stat = True
-        if valid_only:
-            stat = BaseConversation.is_valid == True
-        r = await session.execute(select(BaseConversation).where(stat))
-        results = r.scalars().all()
-        results = jsonable_encoder(results)
-        return results
+        stmt = _all_valid_conversations_stmt if valid_only else _all_conversations_stmt
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        r = await session.stream(stmt, {"offset": offset}, execution_options={"yield_per": 200})
+        async for partition in r.partitions():
+            conversations = _construct_conversations(partition)
+            if len(result) + len(conversations) > THREADPOOL_DUMP_THRESHOLD:
+                result.extend(await run_in_threadpool(_dump_conversations, conversations))
+            else:
+                result.extend(_dump_conversations(conversations))
+    return response(200, result=result)
 
 
 @router.get("/conv/{conversation_id}", tags=["conversation"],
             response_model=OpenaiApiConversationHistoryDocument | OpenaiWebConversationHistoryDocument | BaseConversationHistory)
 async def get_conversation_history(conversation: BaseConversation = Depends(_get_conversation_by_id),
-                                   user: User = Depends(current_active_user)):
+                                   user: User = Depends(current_active_user),
+                                   session: AsyncSession = Depends(get_async_session),
+                                   refresh: bool = False, raw: bool = False):
+    """
+    raw 为 True 时，直接以流的方式转发上游返回的原始 JSON（仅 openai_web），不经过解析和转换，也不包装为统一的返回格式
+    """
     if conversation.source == ChatSourceTypes.openai_web:
         try:
+            if raw:
+                upstream = await openai_web_manager.open_conversation_history_stream(conversation.conversation_id,
+                                                                                     conversation.source_id)
+                return StreamingResponse(upstream.aiter_bytes(), media_type="application/json",
+                                         background=BackgroundTask(upstream.aclose))
             result = await openai_web_manager.get_conversation_history(conversation.conversation_id,
-                                                                       conversation.source_id)
+                                                                       conversation.source_id, refresh=refresh)
             if result.current_model != conversation.current_model or not conversation.is_valid:
-                async with get_async_session_context() as session:
-                    conversation = await session.get(BaseConversation, conversation.id)
-                    conversation.current_model = result.current_model
-                    conversation.is_valid = True
-                    await session.commit()
+                conversation.current_model = result.current_model
+                conversation.is_valid = True
+                await session.commit()
             return result
         except httpx.TimeoutException as e:
             logger.warning(
@@ -87,10 +191,8 @@ async def get_conversation_history(conversation: BaseConversation = Depends(_get
         except OpenaiWebException as e:
             if e.code == 404:
                 if conversation.is_valid:
-                    async with get_async_session_context() as session:
-                        conversation = await session.get(BaseConversation, conversation.id)
-                        conversation.is_valid = False
-                        await session.commit()
+                    conversation.is_valid = False
+                    await session.commit()
             raise e
         except Exception as e:
             logger.warning(
@@ -105,8 +207,8 @@ async def get_conversation_history(conversation: BaseConversation = Depends(_get
 
 @router.get("/conv/{conversation_id}/cache", tags=["conversation"],
             response_model=OpenaiApiConversationHistoryDocument | OpenaiWebConversationHistoryDocument | BaseConversationHistory)
-async def get_conversation_history_from_cache(conversation_id, user: User = Depends(current_super_user)):
-    conversation = await _get_conversation_by_id(conversation_id, user=user)
+async def get_conversation_history_from_cache(conversation: BaseConversation = Depends(_get_conversation_by_id),
+                                              _user: User = Depends(current_super_user)):
     if conversation.source == ChatSourceTypes.openai_web:
         doc = await OpenaiWebConversationHistoryDocument.get(conversation.conversation_id)
     else:
@@ -116,110 +218,153 @@ async def get_conversation_history_from_cache(conversation_id, user: User = Depe
     return doc
 
 
+async def _invalidate_conversation(session: AsyncSession, conversation_id: str | uuid.UUID, user: User):
+    """
+    将会话标记为 invalid，返回会话的 (conversation_id, source, source_id)
+    返回的 conversation_id 取自数据库，与历史缓存等处使用的键一致（路径中的 id 可能是大写等其他写法）
+    权限检查与更新合并为一条 UPDATE ... RETURNING；仅当没有更新任何行时，才再查询一次以确定具体原因
+    """
+    conversation_id = str(conversation_id)
+    stmt = update(BaseConversation).where(BaseConversation.conversation_id == conversation_id,
+                                          BaseConversation.is_valid == True)
+    if not user.is_superuser:
+        stmt = stmt.where(BaseConversation.user_id == user.id)
+    stmt = stmt.values(is_valid=False) \
+        .returning(BaseConversation.conversation_id, BaseConversation.source, BaseConversation.source_id) \
+        .execution_options(synchronize_session=False)
+    invalidated = (await session.execute(stmt)).one_or_none()
+    if invalidated is None:
+        r = await session.execute(select(BaseConversation.user_id).where(
+            BaseConversation.conversation_id == conversation_id))
+        owner = r.one_or_none()
+        if owner is None:
+            raise InvalidParamsException("errors.conversationNotFound")
+        if not user.is_superuser and owner.user_id != user.id:
+            raise AuthorityDenyException
+        raise InvalidParamsException("errors.conversationAlreadyDeleted")
+    await session.commit()
+    return invalidated
+
+
 @router.delete("/conv/{conversation_id}", tags=["conversation"])
-async def delete_conversation(conversation: BaseConversation = Depends(_get_conversation_by_id),
-                              user: User = Depends(current_active_user)):
+async def delete_conversation(conversation_id: str | uuid.UUID,
+                              user: User = Depends(current_active_user),
+                              session: AsyncSession = Depends(get_async_session)):
     """
     软删除：标记为 invalid 并且从 chatgpt 账号中删除会话，但不会删除 mongodb 中的历史记录
+    chatgpt 账号中的会话由后台任务批量删除，删除失败仅记录日志
     """
-    if not conversation.is_valid:
-        raise InvalidParamsException("errors.conversationAlreadyDeleted")
-    if conversation.source == ChatSourceTypes.openai_web:
-        try:
-            await openai_web_manager.delete_conversation(conversation.conversation_id, conversation.source_id)
-        except OpenaiWebException as e:
-            logger.warning(f"delete conversation {conversation.conversation_id} failed: {e.code} {e.message}")
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code != 404:
-                raise e
-    async with get_async_session_context() as session:
-        conversation.is_valid = False
-        session.add(conversation)
-        await session.commit()
+    conversation_id, source, source_id = await _invalidate_conversation(session, conversation_id, user)
+    if source == ChatSourceTypes.openai_web:
+        openai_web_manager.queue_delete_conversation(conversation_id, source_id)
+        openai_web_manager.invalidate_conversation_history(conversation_id)
     return response(200)
 
 
 @router.delete("/conv/{conversation_id}/vanish", tags=["conversation"])
 async def vanish_conversation(conversation: BaseConversation = Depends(_get_conversation_by_id),
-                              _user: User = Depends(current_super_user)):
+                              _user: User = Depends(current_super_user),
+                              session: AsyncSession = Depends(get_async_session)):
     """
     硬删除：删除数据库和账号中的对话和历史记录
     """
     if conversation.is_valid:
-        await delete_conversation(conversation, conversation.source_id)
+        await delete_conversation(conversation.conversation_id, _user, session)
     if conversation.source == ChatSourceTypes.openai_web:
+        openai_web_manager.invalidate_conversation_history(conversation.conversation_id)
         doc = await OpenaiWebConversationHistoryDocument.get(conversation.conversation_id)
     else:  # api
         doc = await OpenaiApiConversationHistoryDocument.get(conversation.conversation_id)
     if doc is not None:
         await doc.delete()
-    async with get_async_session_context() as session:
-        await session.execute(
-            delete(BaseConversation).where(BaseConversation.conversation_id == conversation.conversation_id))
-        await session.commit()
+    conversation_id = conversation.conversation_id
+    await session.execute(
+        lambda_stmt(lambda: delete(BaseConversation).where(BaseConversation.conversation_id == conversation_id)))
+    await session.commit()
     return response(200)
 
 
 @router.patch("/conv/{conversation_id}", tags=["conversation"], response_model=BaseConversationSchema)
 async def update_conversation_title(title: str, conversation: BaseConversation = Depends(_get_conversation_by_id),
-                                    user: User = Depends(current_active_user)):
-    if conversation.source == ChatSourceTypes.openai_web:
-        await openai_web_manager.set_conversation_title(conversation.conversation_id,
-                                                        title, conversation.source_id)
-    else:  # api
-        doc = await OpenaiApiConversationHistoryDocument.get(conversation.conversation_id)
-        if doc is None:
-            raise InvalidParamsException("errors.conversationNotFound")
-        doc.title = title
-        await doc.save()
-    async with get_async_session_context() as session:
+                                    user: User = Depends(current_active_user),
+                                    session: AsyncSession = Depends(get_async_session)):
+    async def set_source_title():
+        if conversation.source == ChatSourceTypes.openai_web:
+            await openai_web_manager.set_conversation_title(conversation.conversation_id,
+                                                            title, conversation.source_id)
+            openai_web_manager.invalidate_conversation_history(conversation.conversation_id)
+        else:  # api
+            doc = await OpenaiApiConversationHistoryDocument.get(conversation.conversation_id)
+            if doc is None:
+                raise InvalidParamsException("errors.conversationNotFound")
+            doc.title = title
+            await doc.save()
+
+    async def persist_title():
         conversation.title = title
-        session.add(conversation)
         await session.commit()
-        await session.refresh(conversation)
-    result = jsonable_encoder(conversation)
-    return result
+
+    # 上游和数据库的更新互不依赖，并发执行；若上游失败，则把数据库中的标题改回去
+    old_title = conversation.title
+    source_result, db_result = await asyncio.gather(set_source_title(), persist_title(), return_exceptions=True)
+    if isinstance(db_result, Exception):
+        raise db_result
+    if isinstance(source_result, Exception):
+        conversation.title = old_title
+        await session.commit()
+        raise source_result
+    result = _encode_conversation(_conversation_values(conversation))
+    return response(200, result=result)
 
 
 @router.patch("/conv/{conversation_id}/assign/{username}", tags=["conversation"])
 async def assign_conversation(username: str, conversation: BaseConversation = Depends(_get_conversation_by_id),
-                              _user: User = Depends(current_super_user)):
-    async with get_async_session_context() as session:
-        user = await session.execute(select(User).where(User.username == username))
-        user = user.scalars().one_or_none()
-        if user is None:
-            raise InvalidParamsException("errors.userNotFound")
-        conversation.user_id = user.id
-        session.add(conversation)
-        await session.commit()
+                              _user: User = Depends(current_super_user),
+                              session: AsyncSession = Depends(get_async_session)):
+    # 查找用户和更新会话合并为一条 UPDATE；会话已由依赖项确认存在，没有更新任何行即说明用户不存在
+    new_user_id = select(User.id).where(User.username == username)
+    r = await session.execute(
+        update(BaseConversation)
+        .where(BaseConversation.id == conversation.id, new_user_id.exists())
+        .values(user_id=new_user_id.scalar_subquery())
+        .returning(BaseConversation.user_id)
+        .execution_options(synchronize_session=False))
+    if r.scalar_one_or_none() is None:
+        raise InvalidParamsException("errors.userNotFound")
+    await session.commit()
     return response(200)
 
 
 @router.delete("/conv", tags=["conversation"])
-async def delete_all_conversation(_user: User = Depends(current_super_user)):
-    await openai_web_manager.clear_conversations()
-    await openai_web_manager.clear_conversations(use_team=True)
-    async with get_async_session_context() as session:
-        await session.execute(delete(OpenaiWebConversation))
-        await session.commit()
+async def delete_all_conversation(_user: User = Depends(current_super_user),
+                                  session: AsyncSession = Depends(get_async_session)):
+    # 个人和团队账号的清空并发执行；两者都成功后才删除数据库中的会话
+    # 数据库的删除不放进 gather：SQLite 执行 DELETE 后会持有写锁直到提交，不能跨越网络请求
+    results = await asyncio.gather(openai_web_manager.clear_conversations(),
+                                   openai_web_manager.clear_conversations(use_team=True),
+                                   return_exceptions=True)
+    openai_web_manager.invalidate_conversation_history()
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    await session.execute(delete(OpenaiWebConversation))
+    await session.commit()
     return response(200)
 
 
 @router.patch("/conv/{conversation_id}/gen_title", tags=["conversation"], response_model=str)
 async def generate_conversation_title(message_id: str,
                                       conversation: OpenaiWebConversation = Depends(_get_conversation_by_id),
-                                      _user: User = Depends(current_active_user)):
-    async with get_async_session_context() as session:
-        title = await openai_web_manager.generate_conversation_title(conversation.conversation_id, message_id,
-                                                                     conversation.source_id)
-        if title:
-            conversation.title = title
-            session.add(conversation)
-            await session.commit()
-            await session.refresh(conversation)
-        else:
-            raise InternalException("errors.generateTitleFailed")
-        return title
+                                      _user: User = Depends(current_active_user),
+                                      session: AsyncSession = Depends(get_async_session)):
+    title = await openai_web_manager.generate_conversation_title(conversation.conversation_id, message_id,
+                                                                 conversation.source_id)
+    if not title:
+        raise InternalException("errors.generateTitleFailed")
+    openai_web_manager.invalidate_conversation_history(conversation.conversation_id)
+    conversation.title = title
+    await session.commit()
+    return title
 
 
 @router.get("/conv/{conversation_id}/interpreter", tags=["conversation"], response_model=OpenaiChatInterpreterInfo)
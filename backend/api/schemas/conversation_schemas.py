@@ -85,7 +85,8 @@ class BaseConversationSchema(BaseModel):
     create_time: datetime.datetime | None = None
     update_time: datetime.datetime | None = None
 
-    model_config = ConfigDict(from_attributes=True)
+    # 延迟到首次使用时再构建 validator/serializer，减少启动时间和每个 worker 的内存占用
+    model_config = ConfigDict(from_attributes=True, defer_build=True)
 
     @model_validator(mode='before')
     @classmethod
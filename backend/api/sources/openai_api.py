@@ -37,14 +37,15 @@ async def _check_response(response: httpx.Response) -> None:
 
 
 def make_session() -> httpx.AsyncClient:
+    limits = httpx.Limits(max_keepalive_connections=64)
     if config.openai_api.proxy is not None:
         proxies = {
             "http://": config.openai_api.proxy,
             "https://": config.openai_api.proxy,
         }
-        session = httpx.AsyncClient(proxies=proxies, timeout=None)
+        session = httpx.AsyncClient(proxies=proxies, timeout=None, limits=limits)
     else:
-        session = httpx.AsyncClient(timeout=None)
+        session = httpx.AsyncClient(timeout=None, limits=limits)
     return session
 
 
@@ -59,6 +60,9 @@ class OpenaiApiChatManager(metaclass=SingletonMeta):
     def reset_session(self):
         self.session = make_session()
 
+    async def close_session(self):
+        await self.session.aclose()
+
     async def complete(self, model: OpenaiApiChatModels, text_content: str, conversation_id: uuid.UUID = None,
                        parent_message_id: uuid.UUID = None,
                        context_message_count: int = -1, extra_args: Optional[dict] = None, **_kwargs):
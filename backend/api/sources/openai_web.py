@@ -1,6 +1,9 @@
 import asyncio
+import functools
 import json
+import time
 import uuid
+from collections import OrderedDict
 from mimetypes import guess_type
 
 import websockets
@@ -36,6 +39,11 @@ config = Config()
 credentials = Credentials()
 logger = get_logger(__name__)
 
+DELETION_BATCH_SIZE = 8
+DELETION_BATCH_INTERVAL = 1  # seconds
+HISTORY_CACHE_TTL = 30  # seconds
+HISTORY_CACHE_MAX_SIZE = 1024
+
 
 def convert_openai_web_message(item: dict, message_id: str = None) -> OpenaiWebChatMessage | None:
     if not item.get("message"):
@@ -175,14 +183,16 @@ def team_headers(chatgpt_account_id: str = None):
 
 
 def make_session() -> httpx.AsyncClient:
+    # 整个进程共用一个 client，复用连接池中的连接，避免每次请求重新建立 TCP/TLS 连接
+    limits = httpx.Limits(max_keepalive_connections=64)
     if config.openai_web.proxy is not None and config.openai_web.proxy != "":
         proxies = {
             "http://": config.openai_web.proxy,
             "https://": config.openai_web.proxy,
         }
-        session = httpx.AsyncClient(proxies=proxies, timeout=config.openai_web.common_timeout)
+        session = httpx.AsyncClient(proxies=proxies, timeout=config.openai_web.common_timeout, limits=limits)
     else:
-        session = httpx.AsyncClient(timeout=config.openai_web.common_timeout)
+        session = httpx.AsyncClient(timeout=config.openai_web.common_timeout, limits=limits)
     session.headers.clear()
     session.headers.update(default_header())
     return session
@@ -239,6 +249,10 @@ class OpenaiWebChatManager(metaclass=SingletonMeta):
         self.semaphore = asyncio.Semaphore(config.openai_web.max_completion_concurrency)
         self.session: AsyncClient | None = None
         self.reset_session()
+        self._deletion_queue: asyncio.Queue[tuple[str, str | None]] = asyncio.Queue()
+        self._deletion_task: asyncio.Task | None = None
+        self._history_cache: OrderedDict[str, tuple[float, OpenaiWebConversationHistoryDocument]] = OrderedDict()
+        self._history_fetches: dict[str, asyncio.Future] = {}
 
     def is_busy(self):
         return self.semaphore.locked()
@@ -246,6 +260,20 @@ class OpenaiWebChatManager(metaclass=SingletonMeta):
     def reset_session(self):
         self.session = make_session()
 
+    async def close_session(self):
+        """
+        先取消后台删除任务再关闭 session；尚未删除的会话不会持久化，仅记录数量
+        """
+        if self._deletion_task is not None and not self._deletion_task.done():
+            self._deletion_task.cancel()
+            try:
+                await self._deletion_task
+            except asyncio.CancelledError:
+                pass
+        if not self._deletion_queue.empty():
+            logger.warning(f"{self._deletion_queue.qsize()} queued conversation deletions dropped on shutdown")
+        await self.session.aclose()
+
     async def check_accounts(self) -> OpenaiWebAccountsCheckResponse:
         url = f"{config.openai_web.chatgpt_base_url}accounts/check/v4-2023-04-27"
         response = await self.session.get(url)
@@ -274,8 +302,72 @@ class OpenaiWebChatManager(metaclass=SingletonMeta):
 
         return _results
 
-    async def get_conversation_history(self, conversation_id: uuid.UUID | str,
-                                       source_id: str = None) -> OpenaiWebConversationHistoryDocument:
+    async def get_conversation_history(self, conversation_id: uuid.UUID | str, source_id: str = None,
+                                       refresh: bool = False) -> OpenaiWebConversationHistoryDocument:
+        """
+        获取的结果缓存 HISTORY_CACHE_TTL 秒；同一会话的并发请求共享同一次上游请求
+        refresh 为 True 时跳过缓存，强制从上游获取
+        """
+        key = str(conversation_id)
+        if not refresh:
+            cached = self._history_cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < HISTORY_CACHE_TTL:
+                return cached[1]
+            fetching = self._history_fetches.get(key)
+            if fetching is not None:
+                return await asyncio.shield(fetching)
+
+        fetching = asyncio.ensure_future(self._fetch_conversation_history(conversation_id, source_id))
+        self._history_fetches[key] = fetching
+        fetching.add_done_callback(functools.partial(self._on_history_fetched, key))
+        return await asyncio.shield(fetching)
+
+    def _on_history_fetched(self, key: str, fetching: asyncio.Future):
+        """
+        在 future 的回调中清理进行中的请求并写入缓存，发起请求的调用方被取消（如客户端断开）时不影响其他等待者
+        若期间缓存被 invalidate 或被 refresh 的请求替换，则丢弃本次结果
+        """
+        # 读取异常，避免无人等待时出现 "exception was never retrieved"
+        failed = fetching.cancelled() or fetching.exception() is not None
+        if self._history_fetches.get(key) is not fetching:
+            return
+        del self._history_fetches[key]
+        if failed:
+            return
+        self._history_cache[key] = (time.monotonic(), fetching.result())
+        self._history_cache.move_to_end(key)
+        while len(self._history_cache) > HISTORY_CACHE_MAX_SIZE:
+            self._history_cache.popitem(last=False)
+
+    async def open_conversation_history_stream(self, conversation_id: uuid.UUID | str,
+                                               source_id: str = None) -> httpx.Response:
+        """
+        以流的方式请求上游的原始会话历史，不做解析和转换
+        返回的 response 已检查过状态码，调用方读取完 response.aiter_bytes() 后需要调用 response.aclose()
+        """
+        url = f"{config.openai_web.chatgpt_base_url}conversation/{conversation_id}"
+        request = self.session.build_request("GET", url, timeout=None, headers=team_headers(source_id))
+        response = await self.session.send(request, stream=True)
+        try:
+            await _check_response(response)
+        except Exception:
+            await response.aclose()
+            raise
+        return response
+
+    def invalidate_conversation_history(self, conversation_id: uuid.UUID | str = None):
+        """
+        清除会话历史缓存；conversation_id 为空时清除全部
+        """
+        if conversation_id is None:
+            self._history_cache.clear()
+            self._history_fetches.clear()
+        else:
+            self._history_cache.pop(str(conversation_id), None)
+            self._history_fetches.pop(str(conversation_id), None)
+
+    async def _fetch_conversation_history(self, conversation_id: uuid.UUID | str,
+                                          source_id: str = None) -> OpenaiWebConversationHistoryDocument:
         url = f"{config.openai_web.chatgpt_base_url}conversation/{conversation_id}"
         response = await self.session.get(url, timeout=None, headers=team_headers(source_id))
         response.encoding = 'utf-8'
@@ -435,6 +527,40 @@ class OpenaiWebChatManager(metaclass=SingletonMeta):
                                             headers=team_headers(source_id))
         await _check_response(response)
 
+    def queue_delete_conversation(self, conversation_id: str, source_id: str = None):
+        """
+        将会话加入后台删除队列，不等待上游请求完成
+        """
+        if self._deletion_task is None or self._deletion_task.done():
+            self._deletion_task = asyncio.create_task(self._flush_deletions())
+        self._deletion_queue.put_nowait((str(conversation_id), source_id))
+
+    async def _flush_deletions(self):
+        """
+        每次从队列中取出至多 DELETION_BATCH_SIZE 个会话并发删除，批次之间间隔 DELETION_BATCH_INTERVAL 秒以避免触发限流
+        """
+        while True:
+            batch = [await self._deletion_queue.get()]
+            while len(batch) < DELETION_BATCH_SIZE and not self._deletion_queue.empty():
+                batch.append(self._deletion_queue.get_nowait())
+            try:
+                results = await asyncio.gather(
+                    *[self.delete_conversation(conversation_id, source_id) for conversation_id, source_id in batch],
+                    return_exceptions=True)
+            except asyncio.CancelledError:
+                # 关闭时被取消：未完成的批次放回队列，计入丢弃的数量
+                for item in batch:
+                    self._deletion_queue.put_nowait(item)
+                raise
+            for (conversation_id, _), result in zip(batch, results):
+                if isinstance(result, OpenaiWebException):
+                    if result.code != 404:
+                        logger.warning(f"delete conversation {conversation_id} failed: {result.code} {result.message}")
+                elif isinstance(result, Exception):
+                    logger.warning(
+                        f"delete conversation {conversation_id} failed: {result.__class__.__name__} {result}")
+            await asyncio.sleep(DELETION_BATCH_INTERVAL)
+
     async def set_conversation_title(self, conversation_id: str, title: str, source_id: str = None):
         url = f"{config.openai_web.chatgpt_base_url}conversation/{conversation_id}"
         response = await self.session.patch(url, json={"title": title},
@@ -25,7 +25,7 @@ from api.models.db import User
 from api.response import CustomJSONResponse, handle_exception_response, handle_arkose_forward_exception
 from api.routers import users, conv, chat, system, status, files, logs, arkose
 from api.schemas import UserCreate, UserSettingSchema
-from api.sources import OpenaiWebChatManager
+from api.sources import OpenaiWebChatManager, OpenaiApiChatManager
 from api.users import get_user_manager_context
 from utils.admin import sync_conversations
 from utils.logger import setup_logger, get_log_config, get_logger
@@ -111,6 +111,8 @@ async def startup():
 async def lifespan(app: FastAPI):
     await startup()
     yield
+    await OpenaiWebChatManager().close_session()
+    await OpenaiApiChatManager().close_session()
 
 
 app = FastAPI(
@@ -0,0 +1,14 @@
+import os
+import shutil
+import sys
+import tempfile
+
+# 导入 api 模块时会读取配置文件，这里使用模板配置，并把 backend 目录加入 sys.path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+if "CWS_CONFIG_DIR" not in os.environ:
+    config_dir = tempfile.mkdtemp()
+    for filename in ("config.yaml", "credentials.yaml"):
+        shutil.copyfile(os.path.join(backend_dir, "config_templates", filename), os.path.join(config_dir, filename))
+    os.environ["CWS_CONFIG_DIR"] = config_dir
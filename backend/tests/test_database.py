@@ -0,0 +1,22 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool, SingletonThreadPool
+
+from api.database.sqlalchemy import check_engine_pool
+from api.exceptions import ConfigException
+
+
+def test_check_engine_pool_accepts_configured_engine():
+    check_engine_pool()
+
+
+def test_check_engine_pool_accepts_aiosqlite_defaults(tmp_path):
+    check_engine_pool(create_async_engine("sqlite+aiosqlite:///:memory:"))
+    check_engine_pool(create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'database.db'}"))
+
+
+@pytest.mark.parametrize("poolclass", [QueuePool, SingletonThreadPool])
+def test_check_engine_pool_rejects_sync_pools(poolclass):
+    with pytest.raises(ConfigException):
+        check_engine_pool(create_engine("sqlite://", poolclass=poolclass))